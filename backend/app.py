@@ -1,11 +1,13 @@
-from fastapi import FastAPI, UploadFile, File, Body
+from fastapi import FastAPI, UploadFile, File, Body, BackgroundTasks, HTTPException
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 import os
 import json
+import asyncio
+import aiofiles
 
 from ingestion import ingest_files
-from rag_pipeline import ask_question
+from rag_pipeline import ask_question, answer_cache, _get_store
 from schemas import RAGAnswer
 
 app = FastAPI(
@@ -14,11 +16,82 @@ app = FastAPI(
     version="1.1.0"
 )
 
+
+# -------------------------------
+# Startup: warm embeddings + vectorstores
+# -------------------------------
+@app.on_event("startup")
+async def _warm():
+    """Loads the embedding model and Chroma collection before the first request."""
+    _get_store()
+
+
+# -------------------------------
+# Feedback writer (single background task)
+# -------------------------------
+FEEDBACK_LOG = "feedback_log.jsonl"
+FEEDBACK_FLUSH_TIMEOUT = 5.0  # seconds to wait for pending feedback on shutdown
+feedback_queue: asyncio.Queue = asyncio.Queue()
+
+
+async def _feedback_writer():
+    """Drains queued feedback entries and appends each batch to the log in one write."""
+    async with aiofiles.open(FEEDBACK_LOG, "a") as f:
+        while True:
+            items = [await feedback_queue.get()]
+            while not feedback_queue.empty():
+                items.append(feedback_queue.get_nowait())
+            try:
+                await f.write("".join(json.dumps(item) + "\n" for item in items))
+                await f.flush()
+            except Exception as e:
+                print(f"[ERROR] Failed to write feedback: {e}")
+            finally:
+                for _ in items:
+                    feedback_queue.task_done()
+
+
+def _feedback_writer_error():
+    """Returns the exception that stopped the writer task, or None if it is still running."""
+    task = app.state.feedback_writer
+    if not task.done():
+        return None
+    if task.cancelled():
+        return asyncio.CancelledError()
+    return task.exception()
+
+
+def _report_feedback_writer_exit(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        print(f"[ERROR] Feedback writer stopped: {task.exception()!r}")
+
+
+@app.on_event("startup")
+async def _start_feedback_writer():
+    app.state.feedback_writer = asyncio.create_task(_feedback_writer())
+    app.state.feedback_writer.add_done_callback(_report_feedback_writer_exit)
+
+
+@app.on_event("shutdown")
+async def _stop_feedback_writer():
+    """Flushes pending feedback (bounded by FEEDBACK_FLUSH_TIMEOUT) before stopping the writer."""
+    error = _feedback_writer_error()
+    if error is not None:
+        print(f"[ERROR] Feedback writer was not running; {feedback_queue.qsize()} entries lost: {error!r}")
+        return
+    try:
+        await asyncio.wait_for(feedback_queue.join(), FEEDBACK_FLUSH_TIMEOUT)
+    except asyncio.TimeoutError:
+        print(f"[WARN] Timed out flushing feedback; {feedback_queue.qsize()} entries not written.")
+    app.state.feedback_writer.cancel()
+
+
 # -------------------------------
 # Request Schema
 # -------------------------------
 class AskPayload(BaseModel):
     question: str
+    domains: Optional[List[str]] = None  # restrict retrieval to these domains
 
 
 # -------------------------------
@@ -32,11 +105,25 @@ def health():
 # -------------------------------
 # File Upload Endpoint
 # -------------------------------
+UPLOAD_CHUNK_SIZE = 1 << 20  # stream uploads to disk 1 MiB at a time
+
+
+def _index_uploads(saved_files: List[str]):
+    """Indexes saved uploads, then drops cached answers that may now be stale."""
+    try:
+        ingest_files(saved_files)
+    except Exception as e:
+        print(f"[ERROR] Failed to index {saved_files}: {e}")
+    finally:
+        # Even a failed ingestion may have added some batches
+        answer_cache.clear()
+
+
 @app.post("/upload")
-async def upload(files: List[UploadFile] = File(...)):
+async def upload(background_tasks: BackgroundTasks, files: List[UploadFile] = File(...)):
     """
     Accepts uploaded files (PDF/TXT), saves them to data/uploads/,
-    and indexes them into the Chroma vector database.
+    and queues them for indexing into the Chroma vector database.
     """
     upload_dir = os.path.join("data", "uploads")
     os.makedirs(upload_dir, exist_ok=True)
@@ -44,31 +131,33 @@ async def upload(files: List[UploadFile] = File(...)):
     saved_files = []
     for f in files:
         file_path = os.path.join(upload_dir, f.filename)
-        with open(file_path, "wb") as out:
-            out.write(await f.read())
+        async with aiofiles.open(file_path, "wb") as out:
+            while chunk := await f.read(UPLOAD_CHUNK_SIZE):
+                await out.write(chunk)
         saved_files.append(file_path)
 
-    count = ingest_files(saved_files)
-    return {"status": "indexed", "files": [f.filename for f in files], "chunks_indexed": count}
+    # Ingestion (PDF parsing + embedding) runs after the response is sent
+    background_tasks.add_task(_index_uploads, saved_files)
+    return {"status": "queued", "files": [f.filename for f in files]}
 
 
 # -------------------------------
 # Question-Answer Endpoint
 # -------------------------------
 @app.post("/ask", response_model=RAGAnswer)
-def ask(payload: AskPayload):
+async def ask(payload: AskPayload):
     """
     Takes a question and returns a structured JSON answer
     using the RAG pipeline (retrieval + reasoning).
     """
-    return ask_question(payload.question)
+    return await ask_question(payload.question, domains=payload.domains)
 
 
 # -------------------------------
 # Feedback Endpoint (Stretch Goal)
 # -------------------------------
 @app.post("/feedback")
-def feedback(
+async def feedback(
     rating: int = Body(..., embed=True),
     question: str = Body(..., embed=True),
     comments: str = Body(default="")
@@ -79,15 +168,16 @@ def feedback(
     - question: original user question
     - comments: optional user notes
     """
-    feedback_log = "feedback_log.jsonl"
     feedback_entry = {
         "question": question,
         "rating": rating,
         "comments": comments
     }
 
-    with open(feedback_log, "a") as f:
-        json.dump(feedback_entry, f)
-        f.write("\n")
+    # Persisted by the background writer task
+    error = _feedback_writer_error()
+    if error is not None:
+        raise HTTPException(status_code=503, detail=f"Feedback log unavailable: {error!r}")
+    await feedback_queue.put(feedback_entry)
 
     return {"status": "recorded", "message": "Feedback logged successfully"}
@@ -1,11 +1,116 @@
 import os
-import uuid
+import hashlib
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
 from typing import List
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_chroma import Chroma
 from langchain_huggingface import HuggingFaceEmbeddings
-from PyPDF2 import PdfReader
+from pdf_worker import extract_pages, pdfium, read_small_pdf
 
+# Shared collection for every domain, indexed with HNSW tuned for cosine top-k retrieval
+COLLECTION_NAME = "docs_all"
+HNSW_METADATA = {
+    "hnsw:space": "cosine",
+    "hnsw:M": 32,
+    "hnsw:construction_ef": 200,
+    "hnsw:search_ef": 64,
+}
+
+# PDFs are extracted in blocks of this many pages per worker process
+PAGES_PER_TASK = 10
+PDF_MAX_WORKERS = min(os.cpu_count() or 1, 8)
+
+# Max records per Chroma add() call (kept below Chroma's max batch size)
+ADD_BATCH_SIZE = 1000
+
+# Default text chunking settings
+CHUNK_SIZE = 1200
+CHUNK_OVERLAP = 150
+
+
+# -------------------------
+# Helper: Shared embeddings (loaded once per process)
+# -------------------------
+@lru_cache(maxsize=1)
+def get_embeddings() -> HuggingFaceEmbeddings:
+    """Loads MiniLM once, on the GPU in FP16 when available, else on CPU."""
+    import torch
+
+    model_kwargs = {"device": "cpu"}
+    if torch.cuda.is_available():
+        model_kwargs = {"device": "cuda", "model_kwargs": {"torch_dtype": torch.float16}}
+
+    return HuggingFaceEmbeddings(
+        model_name="all-MiniLM-L6-v2",
+        model_kwargs=model_kwargs,
+        encode_kwargs={"batch_size": 64, "normalize_embeddings": True},
+    )
+
+
+# -------------------------
+# Helper: Extract PDF text in worker processes
+# -------------------------
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    """Returns the shared PDF worker pool, created on first use.
+
+    Workers are spawned rather than forked: the API process already runs
+    torch, the embedding model and Chroma threads, which fork can deadlock.
+    """
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = ProcessPoolExecutor(
+                max_workers=PDF_MAX_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pdf_pool
+
+
+def _reset_pdf_pool(broken: ProcessPoolExecutor) -> None:
+    """Drops the shared pool after a worker died so the next call spawns a fresh one."""
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is broken:
+            _pdf_pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def _extract_pdf(file_path: str) -> str:
+    """Extracts PDF text in the worker pool, retrying once on a fresh pool if a worker crashed."""
+    for attempt in range(2):
+        pool = _get_pdf_pool()
+        try:
+            return _extract_pdf_with(pool, file_path)
+        except BrokenProcessPool:
+            _reset_pdf_pool(pool)
+            if attempt:
+                raise
+            print(f"[WARN] PDF worker crashed on {file_path}; retrying on a fresh pool.")
+
+
+def _extract_pdf_with(pool: ProcessPoolExecutor, file_path: str) -> str:
+    """Extracts PDF text, fanning large documents out across processes in page order."""
+    if pdfium is not None:
+        # PDFium is not thread-safe, so it only ever runs inside the (single-threaded)
+        # worker processes, never on the API's thread pool; one round trip covers
+        # both the page count and the text of small documents
+        num_pages, text = pool.submit(read_small_pdf, file_path, PAGES_PER_TASK).result()
+    else:
+        num_pages, text = read_small_pdf(file_path, PAGES_PER_TASK)
+    if text is not None:
+        return text
+
+    starts = list(range(0, num_pages, PAGES_PER_TASK))
+    stops = [min(start + PAGES_PER_TASK, num_pages) for start in starts]
+    return "".join(pool.map(extract_pages, [file_path] * len(starts), starts, stops))
 
 
 # -------------------------
@@ -18,11 +123,7 @@ def extract_text(file_path: str) -> str:
 
     if ext == ".pdf":
         try:
-            reader = PdfReader(file_path)
-            for page in reader.pages:
-                content = page.extract_text()
-                if content:
-                    text += content + "\n"
+            text = _extract_pdf(file_path)
         except Exception as e:
             print(f"[ERROR] Failed to read {file_path}: {e}")
 
@@ -41,8 +142,13 @@ def extract_text(file_path: str) -> str:
 # -------------------------
 # Helper: Split text into chunks
 # -------------------------
-def split_text(text: str, chunk_size: int = 1200, overlap: int = 150) -> List[str]:
+_SPLITTER = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+
+
+def split_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
     """Splits long text into overlapping chunks."""
+    if (chunk_size, overlap) == (CHUNK_SIZE, CHUNK_OVERLAP):
+        return _SPLITTER.split_text(text)
     splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=overlap)
     return splitter.split_text(text)
 
@@ -53,24 +159,24 @@ def split_text(text: str, chunk_size: int = 1200, overlap: int = 150) -> List[st
 def ingest_files(files: List[str], category: str = "general"):
     """
     Takes a list of files, extracts text, splits into chunks,
-    and saves to a ChromaDB collection.
+    and saves to the shared ChromaDB collection tagged with `category`.
     """
     # Initialize vector store path
     persist_directory = os.path.join(os.getcwd(), "data", "chroma")
     os.makedirs(persist_directory, exist_ok=True)
 
-    # Initialize embeddings (OpenAI by default)
-    embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+    # Reuse the process-wide embedding model
+    embeddings = get_embeddings()
 
-    # Create or load a Chroma collection
+    # Create or load the shared Chroma collection (domain is stored per chunk)
     vectorstore = Chroma(
-        collection_name=f"docs_{category}",   # <-- dynamically use the domain name
+        collection_name=COLLECTION_NAME,
         embedding_function=embeddings,
-        persist_directory=persist_directory
+        persist_directory=persist_directory,
+        collection_metadata=HNSW_METADATA,
     )
 
-
-    total_chunks = 0
+    all_chunks, all_metas = [], []
 
     for file_path in files:
         print(f"[INFO] Processing: {file_path}")
@@ -80,24 +186,64 @@ def ingest_files(files: List[str], category: str = "general"):
             print(f"[WARN] No text extracted from {file_path}, skipping.")
             continue
 
+        filename = os.path.basename(file_path)
         chunks = split_text(text)
-        metadatas = []
         for i, chunk in enumerate(chunks):
-            metadatas.append({
-                "filename": os.path.basename(file_path),
+            all_metas.append({
+                "filename": filename,
                 "chunk_id": i,
-                "doc_id": str(uuid.uuid4())
+                "domain": category,
+                # Deterministic id so re-ingesting the same content is a no-op
+                "doc_id": hashlib.sha1(f"{filename}:{i}:{chunk}".encode("utf-8")).hexdigest()
             })
+        all_chunks.extend(chunks)
+        print(f"[INFO] Prepared {len(chunks)} chunks from {filename}")
 
-        # Add to Chroma
-        vectorstore.add_texts(
-            texts=chunks,
-            metadatas=metadatas,
-            ids=[m["doc_id"] for m in metadatas]
-        )
+    # Skip chunks already in the collection (or repeated within this batch); ids do not
+    # include the category, so re-tag existing chunks whose domain has changed
+    if all_chunks:
+        # Chroma rejects repeated ids, so look up each distinct id once, in batches
+        candidate_ids = list(dict.fromkeys(m["doc_id"] for m in all_metas))
+        existing_domains = {}
+        for start in range(0, len(candidate_ids), ADD_BATCH_SIZE):
+            existing = vectorstore._collection.get(
+                ids=candidate_ids[start:start + ADD_BATCH_SIZE], include=["metadatas"]
+            )
+            for doc_id, meta in zip(existing["ids"], existing["metadatas"]):
+                existing_domains[doc_id] = (meta or {}).get("domain")
+        seen_ids = set(existing_domains)
+        new_chunks, new_metas, retag_metas = [], [], []
+        for chunk, meta in zip(all_chunks, all_metas):
+            if meta["doc_id"] in seen_ids:
+                if existing_domains.pop(meta["doc_id"], category) != category:
+                    retag_metas.append(meta)
+                continue
+            seen_ids.add(meta["doc_id"])
+            new_chunks.append(chunk)
+            new_metas.append(meta)
+        for start in range(0, len(retag_metas), ADD_BATCH_SIZE):
+            batch = retag_metas[start:start + ADD_BATCH_SIZE]
+            vectorstore._collection.update(ids=[m["doc_id"] for m in batch], metadatas=batch)
+        if retag_metas:
+            print(f"[INFO] Moved {len(retag_metas)} already-indexed chunks to domain '{category}'.")
+        skipped = len(all_chunks) - len(new_chunks)
+        if skipped:
+            print(f"[INFO] Skipping {skipped} already-indexed chunks.")
+        all_chunks, all_metas = new_chunks, new_metas
 
-        total_chunks += len(chunks)
-        print(f"[INFO] Added {len(chunks)} chunks from {os.path.basename(file_path)}")
+    total_chunks = len(all_chunks)
+    if all_chunks:
+        # Embed every chunk in one batched pass, then write the precomputed vectors
+        vectors = embeddings.embed_documents(all_chunks)
+        all_ids = [m["doc_id"] for m in all_metas]
+        for start in range(0, total_chunks, ADD_BATCH_SIZE):
+            end = start + ADD_BATCH_SIZE
+            vectorstore._collection.add(
+                ids=all_ids[start:end],
+                embeddings=vectors[start:end],
+                documents=all_chunks[start:end],
+                metadatas=all_metas[start:end],
+            )
 
     # Persist for reuse
     # vectorstore.persist()
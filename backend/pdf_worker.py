@@ -0,0 +1,68 @@
+from typing import Optional, Tuple
+
+from PyPDF2 import PdfReader
+
+try:
+    import pypdfium2 as pdfium  # C++ PDFium bindings, much faster text extraction
+except ImportError:
+    pdfium = None
+
+# Kept free of LangChain/Chroma imports: this module is imported by every
+# spawned PDF worker process, so it should stay cheap to load.
+
+
+# -------------------------
+# Worker: Extract text from a range of PDF pages
+# -------------------------
+def extract_pages(file_path: str, start: int, stop: int) -> str:
+    """Extracts text from pages [start, stop) of a PDF (runs in a worker process)."""
+    text = ""
+    if pdfium is not None:
+        pdf = pdfium.PdfDocument(file_path)
+        try:
+            for idx in range(start, stop):
+                page = pdf[idx]
+                textpage = page.get_textpage()
+                content = textpage.get_text_range()
+                textpage.close()
+                page.close()
+                if content:
+                    text += content + "\n"
+        finally:
+            pdf.close()
+        return text
+
+    reader = PdfReader(file_path)
+    for idx in range(start, stop):
+        content = reader.pages[idx].extract_text()
+        if content:
+            text += content + "\n"
+    return text
+
+
+# -------------------------
+# Worker: Count PDF pages
+# -------------------------
+def count_pages(file_path: str) -> int:
+    """Returns the number of pages in a PDF (runs in a worker process when using pdfium)."""
+    if pdfium is not None:
+        pdf = pdfium.PdfDocument(file_path)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+    return len(PdfReader(file_path).pages)
+
+
+# -------------------------
+# Worker: Count pages and extract small PDFs in one call
+# -------------------------
+def read_small_pdf(file_path: str, max_pages: int) -> Tuple[int, Optional[str]]:
+    """
+    Returns (page_count, text); text is only extracted when the PDF has at most
+    `max_pages` pages, otherwise it is None and the caller fans the pages out.
+    """
+    num_pages = count_pages(file_path)
+    if num_pages > max_pages:
+        return num_pages, None
+    return num_pages, extract_pages(file_path, 0, num_pages)
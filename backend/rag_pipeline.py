@@ -1,11 +1,21 @@
 import os
 import json
-from typing import List
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache, partial
+from typing import List, Optional, Tuple
+import numpy as np
 from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_chroma.vectorstores import maximal_marginal_relevance
+from langchain_core.documents import Document
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage, SystemMessage
-from schemas import RAGAnswer, Source
+from schemas import RAGAnswer, Source, LLMAnswer
+from ingestion import COLLECTION_NAME, HNSW_METADATA, get_embeddings
+from semantic_cache import LSHCache
 from dotenv import load_dotenv
 from duckduckgo_search import DDGS
 
@@ -14,30 +24,84 @@ load_dotenv()
 
 
 # -----------------------------
-# Helper: Load all vectorstores
+# Helper: Load the shared vectorstore
 # -----------------------------
-def load_all_vectorstores() -> List[Chroma]:
-    """Loads all available Chroma domain collections."""
+DOMAINS = ["finance", "hr", "sustainability", "general"]
+
+
+@lru_cache(maxsize=1)
+def _get_store() -> Chroma:
+    """Opens the single Chroma collection holding every domain (tagged via 'domain' metadata)."""
     persist_directory = os.path.join(os.getcwd(), "data", "chroma")
-    embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+    store = Chroma(
+        collection_name=COLLECTION_NAME,
+        embedding_function=get_embeddings(),
+        persist_directory=persist_directory,
+        collection_metadata=HNSW_METADATA,
+    )
+    print(f"[INFO] Loaded collection '{COLLECTION_NAME}'")
+    return store
 
-    # Define domain-specific collections
-    domain_collections = ["finance", "hr", "sustainability", "general"]
-    stores = []
 
-    for domain in domain_collections:
-        collection_name = f"docs_{domain}"
-        try:
-            store = Chroma(
-                collection_name=collection_name,
-                embedding_function=embeddings,
-                persist_directory=persist_directory,
-            )
-            stores.append((domain, store))
-            print(f"[INFO] Loaded collection '{collection_name}'")
-        except Exception as e:
-            print(f"[WARN] Could not load collection '{collection_name}': {e}")
-    return stores
+# -----------------------------
+# Helper: Query embedding cache (SHA-256 keyed LRU)
+# -----------------------------
+QUERY_CACHE_SIZE = 4096
+_query_cache: "OrderedDict[bytes, List[float]]" = OrderedDict()
+_query_cache_lock = threading.Lock()
+
+
+def cached_embed(question: str) -> List[float]:
+    """Embeds a question, reusing the vector for previously seen identical text."""
+    key = hashlib.sha256(question.encode("utf-8")).digest()
+    with _query_cache_lock:
+        if key in _query_cache:
+            _query_cache.move_to_end(key)
+            return _query_cache[key]
+
+    qvec = get_embeddings().embed_query(question)
+
+    with _query_cache_lock:
+        _query_cache[key] = qvec
+        if len(_query_cache) > QUERY_CACHE_SIZE:
+            _query_cache.popitem(last=False)
+    return qvec
+
+
+# -----------------------------
+# Helper: MMR search that keeps distances
+# -----------------------------
+def _mmr_search(
+    store: Chroma, qvec: List[float], k: int, fetch_k: int, search_filter: Optional[dict] = None
+) -> List[Tuple[Document, float]]:
+    """Fetches fetch_k candidates, then picks k diverse ones via MMR, returning (doc, distance)."""
+    results = store._collection.query(
+        query_embeddings=[qvec],
+        n_results=fetch_k,
+        where=search_filter,
+        include=["documents", "metadatas", "distances", "embeddings"],
+    )
+    if not results["ids"][0]:
+        return []
+
+    selected = maximal_marginal_relevance(
+        np.array(qvec, dtype=np.float32),
+        results["embeddings"][0],
+        lambda_mult=0.5,
+        k=k,
+    )
+    return [
+        (
+            Document(page_content=results["documents"][0][i], metadata=results["metadatas"][0][i] or {}),
+            results["distances"][0][i],
+        )
+        for i in selected
+    ]
+
+
+# Process-wide semantic cache of answers, keyed by question embedding. The TTL bounds
+# staleness when documents are ingested outside the API (e.g. `python ingestion.py`).
+answer_cache = LSHCache(threshold=0.95, ttl_seconds=600)
 
 
 # -----------------------------
@@ -47,17 +111,6 @@ SYSTEM_PROMPT = """
 You are a careful analyst that answers questions using ONLY the provided context.
 If you cannot find a complete answer, list what is missing in the 'missing_info' field.
 
-Respond strictly in the following JSON format:
-{
-  "answer": "string",
-  "confidence": float,
-  "missing_info": ["string"],
-  "citations": [
-      {"doc_id": "string", "filename": "string", "page": int, "score": float, "snippet": "string"}
-  ],
-  "reasoning_summary": "string",
-  "suggestions": ["string"]
-}
 Rules:
 - Never hallucinate or invent facts.
 - If context is partial, confidence <= 0.6.
@@ -65,26 +118,113 @@ Rules:
 """
 
 
+# -----------------------------
+# Helper: Tuning knobs + phase timings
+# -----------------------------
+def _env_flag(name: str, default: str = "true") -> bool:
+    """Reads a boolean env knob ("true"/"false")."""
+    return os.getenv(name, default).strip().lower() == "true"
+
+
+def _env_top_k(default: int = 3) -> int:
+    """Reads RAG_TOP_K, falling back to `default` for non-integer or non-positive values."""
+    raw = os.getenv("RAG_TOP_K", str(default))
+    try:
+        value = int(raw)
+    except ValueError:
+        value = 0
+    if value < 1:
+        print(f"[WARN] Invalid RAG_TOP_K={raw!r}; using {default}.")
+        return default
+    return value
+
+
+# Knobs are read once at import; restart the API to change them
+DEFAULT_TOP_K = _env_top_k()
+RERANK_ENABLED = _env_flag("RAG_RERANK_ENABLED")
+ENRICH_ENABLED = _env_flag("RAG_ENRICH_ENABLED")
+
+
+def _elapsed_ms(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 2)
+
+
+def _log_timings(timings: dict, t_start: float) -> None:
+    """Prints per-phase timings for /ask as a single JSON line."""
+    timings["total_ms"] = _elapsed_ms(t_start)
+    print(f"[TIMING] {json.dumps(timings)}")
+
+
 # -----------------------------
 # Core: Ask a question (multi-domain)
 # -----------------------------
-def ask_question(question: str, top_k: int = 3) -> RAGAnswer:
-    """Retrieve from multiple Chroma domain collections and ask the model."""
-    stores = load_all_vectorstores()
-    if not stores:
-        raise ValueError("No vectorstores found. Run ingestion first!")
+async def ask_question(
+    question: str, top_k: Optional[int] = None, domains: Optional[List[str]] = None
+) -> RAGAnswer:
+    """Retrieve from the shared Chroma collection (optionally restricted to domains) and ask the model."""
+    t_start = time.perf_counter()
+    if top_k is None:
+        top_k = DEFAULT_TOP_K
+    timings = {
+        "top_k": top_k,
+        "rerank_enabled": RERANK_ENABLED,
+        "enrich_enabled": ENRICH_ENABLED,
+    }
+    # Timings are emitted even when a phase (e.g. the LLM call) raises
+    try:
+        return await _answer_question(question, top_k, domains, timings)
+    except Exception:
+        timings["failed"] = True
+        raise
+    finally:
+        _log_timings(timings, t_start)
+
+
+async def _answer_question(
+    question: str, top_k: int, domains: Optional[List[str]], timings: dict
+) -> RAGAnswer:
+    """Runs the embed → cache → search → LLM → enrich pipeline, recording phase timings."""
+    store = _get_store()
+    loop = asyncio.get_running_loop()
+
+    # Embed the question once
+    t0 = time.perf_counter()
+    qvec = await loop.run_in_executor(None, cached_embed, question)
+    timings["t_embed_ms"] = _elapsed_ms(t0)
+
+    # Serve near-duplicate questions straight from the semantic cache; remember the
+    # index generation so an answer built during a re-index is not cached afterwards
+    cache_generation = answer_cache.generation
+    cache_scope = (top_k, RERANK_ENABLED, tuple(sorted(domains or [])))
+    cached = answer_cache.get(qvec, cache_scope)
+    if cached is not None:
+        print("[INFO] Semantic cache hit")
+        timings["cache_hit"] = True
+        return cached
 
+    # Retrieve the global top (top_k x searched domains) hits from the shared collection
+    # in a single index traversal; MMR diversifies them unless RAG_RERANK_ENABLED=false
+    search_filter = {"domain": {"$in": list(domains)}} if domains else None
+    k = top_k * len(domains or DOMAINS)
     all_results = []
-    # Retrieve top-k results per domain (with scores)
-    for domain, store in stores:
-        try:
-            docs_with_scores = store.similarity_search_with_score(question, k=top_k)
-            for doc, score in docs_with_scores:
-                doc.metadata["domain"] = domain
-                doc.metadata["score"] = round(float(score), 3)
-                all_results.append(doc)
-        except Exception as e:
-            print(f"[WARN] Retrieval failed for domain '{domain}': {e}")
+    t0 = time.perf_counter()
+    try:
+        if RERANK_ENABLED:
+            search = partial(_mmr_search, store, qvec, k, k * 4, search_filter)
+        else:
+            search = partial(
+                store.similarity_search_by_vector_with_relevance_scores,
+                qvec,
+                k=k,
+                filter=search_filter,
+            )
+        docs_with_scores = await loop.run_in_executor(None, search)
+        for doc, score in docs_with_scores:
+            doc.metadata["score"] = round(float(score), 3)
+            all_results.append(doc)
+    except Exception as e:
+        print(f"[WARN] Retrieval failed: {e}")
+    timings["t_search_ms"] = _elapsed_ms(t0)
 
     if not all_results:
         return RAGAnswer(
@@ -97,72 +237,45 @@ def ask_question(question: str, top_k: int = 3) -> RAGAnswer:
         )
 
     # -----------------------------
-    # Prepare combined context (deduplicated)
+    # Prepare combined context (MMR-diversified only when RAG_RERANK_ENABLED=true)
     # -----------------------------
-    context_blocks = []
     citations = []
-    seen_files = set()  # prevent duplicates
-
     for doc in all_results:
         meta = doc.metadata
-        filename = meta.get("filename", "unknown")
-
-        # Skip duplicate entries from the same file
-        if filename in seen_files:
-            continue
-        seen_files.add(filename)
-
-        snippet = doc.page_content[:300].replace("\n", " ")
-
         citations.append(
             Source(
                 doc_id=meta.get("doc_id", ""),
-                filename=filename,
+                filename=meta.get("filename", "unknown"),
                 page=meta.get("page", 1),
                 score=meta.get("score", 0.0),
-                snippet=snippet,
+                snippet=doc.page_content[:300].replace("\n", " "),
+                domain=meta.get("domain", "unknown"),
             )
         )
 
-        # attach domain (optional)
-        citations[-1].domain = meta.get("domain", "unknown")
-
-        context_blocks.append(
-            f"[{filename} | {meta.get('domain', 'unknown')} | score={meta.get('score', 0.0)}] → {snippet}"
-        )
-
-    context_text = "\n\n".join(context_blocks)
+    # Build the context in one join from the already-extracted citation fields
+    context_text = "\n\n".join(
+        f"[{c.filename} | {c.domain} | score={c.score}] → {c.snippet}" for c in citations
+    )
     user_prompt = f"Question: {question}\n\nContext:\n{context_text}"
 
     # -----------------------------
     # Call the LLM
     # -----------------------------
-    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.3)
+    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.3).with_structured_output(LLMAnswer)
     messages = [SystemMessage(content=SYSTEM_PROMPT), HumanMessage(content=user_prompt)]
-    response = llm.invoke(messages)
+    t0 = time.perf_counter()
+    answer_obj = await llm.ainvoke(messages)
+    timings["t_llm_ms"] = _elapsed_ms(t0)
+    data = answer_obj.model_dump()
 
-    # -----------------------------
-    # Parse JSON output safely
-    # -----------------------------
-    try:
-        data = json.loads(response.content)
-    except Exception as e:
-        print(f"[WARN] JSON parse error: {e}")
-        print("Raw response:", response.content)
-        data = {
-            "answer": response.content.strip(),
-            "confidence": 0.5,
-            "missing_info": [],
-            "citations": [],
-            "reasoning_summary": "Partial fallback response.",
-            "suggestions": [],
-        }
-
-    # Auto-enrichment if missing info is found
+    # Auto-enrichment if missing info is found (disable with RAG_ENRICH_ENABLED=false)
     auto_data = []
-    if data.get("missing_info"):
+    if ENRICH_ENABLED and data.get("missing_info"):
         print("[INFO] Running auto-enrichment for missing topics...")
-        auto_data = auto_enrich(data.get("missing_info", []))
+        t0 = time.perf_counter()
+        auto_data = await auto_enrich(data.get("missing_info", []))
+        timings["t_enrich_ms"] = _elapsed_ms(t0)
 
     # Append enrichment results to suggestions
     if auto_data:
@@ -172,14 +285,15 @@ def ask_question(question: str, top_k: int = 3) -> RAGAnswer:
     # Add domain coverage note (optional)
     # -----------------------------
     retrieved_domains = {c.domain for c in citations if hasattr(c, "domain")}
-    all_domains = {"finance", "hr", "sustainability", "general"}
+    all_domains = set(domains or DOMAINS)
     missing_domains = all_domains - retrieved_domains
     if missing_domains:
         data["reasoning_summary"] += (
-            f" No documents found for domain(s): {', '.join(missing_domains)}."
+            f" No documents from domain(s) {', '.join(sorted(missing_domains))}"
+            " were among the retrieved results."
         )
 
-    return RAGAnswer(
+    result = RAGAnswer(
         answer=data.get("answer", ""),
         confidence=float(data.get("confidence", 0.5)),
         missing_info=data.get("missing_info", []),
@@ -187,26 +301,32 @@ def ask_question(question: str, top_k: int = 3) -> RAGAnswer:
         reasoning_summary=data.get("reasoning_summary", ""),
         suggestions=data.get("suggestions", []),
     )
+    answer_cache.put(qvec, result, cache_scope, generation=cache_generation)
+    return result
 
 
 # -----------------------------
 # Auto-Enrichment
 # -----------------------------
-def auto_enrich(missing_topics: List[str]) -> List[str]:
-    """Fetch short summaries from DuckDuckGo for missing topics."""
-    suggestions = []
+async def auto_enrich(missing_topics: List[str]) -> List[str]:
+    """Fetch short summaries from DuckDuckGo for missing topics (queried concurrently)."""
     if not missing_topics:
-        return suggestions
-
-    with DDGS() as ddgs:
-        for topic in missing_topics:
-            try:
-                results = list(ddgs.text(topic, max_results=1))
-                if results:
-                    summary = results[0]["body"][:200]
-                    suggestions.append(f"Auto-enriched info for '{topic}': {summary}")
-            except Exception as e:
-                print(f"[WARN] Could not enrich topic '{topic}': {e}")
+        return []
+
+    async def _one(topic: str):
+        try:
+            return await asyncio.to_thread(lambda: list(DDGS().text(topic, max_results=1)))
+        except Exception as e:
+            print(f"[WARN] Could not enrich topic '{topic}': {e}")
+            return []
+
+    results = await asyncio.gather(*(_one(topic) for topic in missing_topics))
+
+    suggestions = []
+    for topic, topic_results in zip(missing_topics, results):
+        if topic_results:
+            summary = topic_results[0]["body"][:200]
+            suggestions.append(f"Auto-enriched info for '{topic}': {summary}")
     return suggestions
 
 
@@ -215,5 +335,5 @@ def auto_enrich(missing_topics: List[str]) -> List[str]:
 # -----------------------------
 if __name__ == "__main__":
     q = "Summarize key financial, HR, and sustainability insights from all documents."
-    res = ask_question(q)
+    res = asyncio.run(ask_question(q))
     print(json.dumps(res.dict(), indent=2))
@@ -20,3 +20,12 @@ class RAGAnswer(BaseModel):
     citations: List[Source]          # Supporting document references
     reasoning_summary: Optional[str] = None  # How the model reasoned
     suggestions: List[str] = []      # Enrichment suggestions
+
+
+class LLMAnswer(BaseModel):
+    """Schema the LLM is constrained to via structured outputs (citations come from retrieval)."""
+    answer: str                      # The final generated answer
+    confidence: float                # Confidence score (0.0–1.0)
+    missing_info: List[str]          # List of gaps or uncertainties
+    reasoning_summary: str           # How the model reasoned
+    suggestions: List[str]           # Additional files or data that would help
@@ -0,0 +1,105 @@
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from schemas import RAGAnswer
+
+
+# -----------------------------
+# Semantic cache (random-projection LSH)
+# -----------------------------
+class LSHCache:
+    """
+    Caches answers keyed by the question embedding.
+    Vectors are hashed with the sign bits of a fixed Gaussian projection;
+    a lookup probes the query's bucket plus every bucket one bit away and
+    returns the best cached answer whose cosine similarity >= threshold.
+    Entries expire after ttl_seconds, and every clear() bumps `generation`
+    so answers computed against an older index are not stored.
+    """
+
+    def __init__(
+        self,
+        dim: int = 384,
+        n_bits: int = 16,
+        threshold: float = 0.95,
+        max_entries: int = 1024,
+        ttl_seconds: float = 600.0,
+        seed: int = 42,
+    ):
+        rng = np.random.default_rng(seed)
+        self.planes = rng.standard_normal((n_bits, dim)).astype(np.float32)
+        self.n_bits = n_bits
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.generation = 0
+        self._weights = 1 << np.arange(n_bits, dtype=np.int64)
+        self._buckets: Dict[int, List[Tuple[np.ndarray, tuple, RAGAnswer, float]]] = {}
+        self._order: deque = deque()  # (bucket, vec) in insertion order, for eviction
+        self._lock = threading.Lock()
+
+    def _normalize(self, qvec: Sequence[float]) -> np.ndarray:
+        vec = np.asarray(qvec, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def _hash(self, vec: np.ndarray) -> int:
+        bits = (self.planes @ vec) > 0
+        return int(bits @ self._weights)
+
+    def _probe(self, bucket: int) -> List[int]:
+        return [bucket] + [bucket ^ (1 << i) for i in range(self.n_bits)]
+
+    def get(self, qvec: Sequence[float], scope: tuple = ()) -> Optional[RAGAnswer]:
+        """Returns the closest cached answer for `scope`, or None if nothing is similar enough."""
+        vec = self._normalize(qvec)
+        best, best_sim = None, self.threshold
+        oldest_valid = time.monotonic() - self.ttl_seconds
+        with self._lock:
+            for bucket in self._probe(self._hash(vec)):
+                for cached_vec, cached_scope, answer, stored_at in self._buckets.get(bucket, ()):
+                    if cached_scope != scope or stored_at < oldest_valid:
+                        continue
+                    sim = float(cached_vec @ vec)
+                    if sim >= best_sim:
+                        best, best_sim = answer, sim
+        return best
+
+    def put(
+        self,
+        qvec: Sequence[float],
+        answer: RAGAnswer,
+        scope: tuple = (),
+        generation: Optional[int] = None,
+    ) -> None:
+        """
+        Stores an answer, evicting the oldest entry once max_entries is reached.
+        If `generation` is given and the cache was cleared since, the answer is dropped.
+        """
+        vec = self._normalize(qvec)
+        bucket = self._hash(vec)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._buckets.setdefault(bucket, []).append((vec, scope, answer, time.monotonic()))
+            self._order.append((bucket, vec))
+            while len(self._order) > self.max_entries:
+                old_bucket, old_vec = self._order.popleft()
+                entries = self._buckets.get(old_bucket, [])
+                for i, (cached_vec, _, _, _) in enumerate(entries):
+                    if cached_vec is old_vec:
+                        del entries[i]
+                        break
+                if not entries:
+                    self._buckets.pop(old_bucket, None)
+
+    def clear(self) -> None:
+        """Drops every cached answer (e.g. after new documents are indexed)."""
+        with self._lock:
+            self._buckets.clear()
+            self._order.clear()
+            self.generation += 1
@@ -1,6 +1,7 @@
 import streamlit as st
 import requests
 import json
+from requests.adapters import HTTPAdapter
 
 # ------------------------------------------------
 # CONFIG
@@ -8,6 +9,17 @@ import json
 API_BASE = "http://127.0.0.1:8000"  # FastAPI backend
 st.set_page_config(page_title="AI Knowledge Search", layout="wide")
 
+
+@st.cache_resource
+def get_session() -> requests.Session:
+    """Keep-alive HTTP session shared across Streamlit reruns."""
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+    return session
+
+
+SESSION = get_session()
+
 # ------------------------------------------------
 # HEADER
 # ------------------------------------------------
@@ -26,10 +38,10 @@ uploaded_files = st.file_uploader(
 
 if st.button("Index Documents") and uploaded_files:
     files = [("files", (f.name, f, f.type)) for f in uploaded_files]
-    with st.spinner("Uploading and indexing..."):
-        res = requests.post(f"{API_BASE}/upload", files=files)
+    with st.spinner("Uploading..."):
+        res = SESSION.post(f"{API_BASE}/upload", files=files)
     if res.status_code == 200:
-        st.success(f"✅ Indexed {res.json().get('chunks_indexed', 0)} chunks.")
+        st.success(f"✅ Queued {len(res.json().get('files', []))} file(s) for indexing.")
     else:
         st.error(f"❌ Upload failed: {res.text}")
 
@@ -45,7 +57,7 @@ if st.button("Ask"):
     else:
         with st.spinner("Thinking..."):
             payload = {"question": question}
-            res = requests.post(f"{API_BASE}/ask", json=payload)
+            res = SESSION.post(f"{API_BASE}/ask", json=payload)
 
         if res.status_code != 200:
             st.error(f"Backend error: {res.text}")